@@ -14,43 +14,890 @@ Examples:
   python3 auto_committer_readme.py --repo /path/to/repo --branch main \
     --file README.md --interval 5 --line-template "* updated at {ts}" --prepend
 
+  # Write a line every second but commit every 10 lines and push every 6 commits:
+  python3 auto_committer_readme.py --repo /path/to/repo --branch main \
+    --interval 1 --batch-commits 10 --push-every 6
+
+  # Don't write anything; commit (and push) whenever another process changes the file:
+  python3 auto_committer_readme.py --repo /path/to/repo --branch main \
+    --file notes.md --on-change
+
+  # Create commits in-process with libgit2 instead of spawning git each tick:
+  python3 auto_committer_readme.py --repo /path/to/repo --branch main --backend pygit2
+
+  # Or stream commits into one long-running `git fast-import` (no extra packages):
+  python3 auto_committer_readme.py --repo /path/to/repo --branch main --backend fast-import
+
+  # From Python, without spawning another interpreter (keywords mirror the options):
+  from auto_committer_readme import run_loop
+  run_loop(repo="/path/to/repo", branch="main", interval=5, max_commits=10)
+
 Notes:
-  - Requires: git CLI; repo cloned; push auth configured.
-  - Heavy push frequency can trigger rate limits on hosting providers.
+  - Requires: git CLI (resolved on PATH once at startup); repo cloned; push auth configured.
+  - --backend pygit2 requires the pygit2 package. Pushes still go through the git CLI,
+    so existing credential helpers and SSH config keep working.
+  - --backend fast-import makes its commits on top of the branch tip, but only moves the
+    branch before each push and on exit, and re-syncs the file's index entry on exit;
+    `git status` may show the file as changed meanwhile. Moving the branch is a checkpoint,
+    which still spawns `git unpack-objects` for its small pack, so use --push-every to
+    flush less often. If the branch is moved by something else during the run, the
+    commits since the last push are replaced by one commit of the file on top of the
+    new tip, with a message naming the first and last of them.
+  - Pushes run on a background thread, so a slow remote does not delay the next heartbeat.
+  - Heavy push frequency can trigger rate limits on hosting providers; --batch-commits and
+    --push-every cut the number of commits and pushes. Pending lines are committed and
+    pushed on Ctrl-C.
+  - --on-change waits on inotify (Linux) or polls the file every --interval elsewhere;
+    line/batch options don't apply, and touching the file without changing it commits nothing.
+  - SSH pushes share one connection (OpenSSH ControlMaster, kept alive 10 minutes) instead
+    of a fresh handshake per push. Disable with --no-ssh-multiplex; skipped when
+    GIT_SSH_COMMAND, GIT_SSH or core.sshCommand is already set. For HTTPS remotes, a
+    credential cache (git config credential.helper "cache --timeout=3600") saves the auth
+    round-trips between pushes.
 """
-import argparse
+import contextlib
+import os
+import re
+import shlex
+import shutil
 import subprocess
 import sys
 import time
-from datetime import datetime, timezone
 from pathlib import Path
 
-def sh(cmd, cwd, env=None):
-    r = subprocess.run(cmd, cwd=cwd, env=env, check=True, capture_output=True, text=True)
-    return r.stdout.strip()
+# Imports only some runs need (argparse, concurrent.futures, pygit2, and ctypes,
+# select and struct for --on-change) are deferred to where they are used; pygit2
+# alone costs ~50 ms of startup. See load_pygit2().
+pygit2 = None
+
+# Absolute path to git, resolved once. subprocess can only use posix_spawn (a
+# vfork-style spawn that doesn't copy the parent's page tables) for an absolute
+# executable; a bare "git" forces fork+exec plus a PATH search on every call.
+GIT = shutil.which("git") or "git"
+
+# Upper bound for --batch-commits / --push-every
+MAX_BATCH = 1000
+
+# Retry delay after a failed push: doubles per consecutive failure, up to the cap
+PUSH_RETRY_BASE = 2.0
+PUSH_RETRY_CAP = 300.0
+
+# How long an idle multiplexed SSH master connection stays up
+SSH_CONTROL_PERSIST = "10m"
+
+def load_pygit2() -> bool:
+    """Import the optional pygit2 package on demand; False if it isn't installed."""
+    global pygit2
+    try:
+        import pygit2 as module
+    except ImportError:
+        return False
+    pygit2 = module
+    return True
+
+class CommitError(Exception):
+    """A commit could not be created; args are printed as the failure details."""
+
+def sh(cmd, cwd, env=None, capture=False, raw=False):
+    """Run git command cmd in repository cwd, raising CalledProcessError on failure.
+
+    stdout is only collected (and returned, decoded and stripped) with capture=True,
+    or returned as untouched bytes with raw=True; otherwise it goes to /dev/null. stderr is always kept as bytes for error
+    reporting, see decoded(). close_fds=False skips the child-side fd sweep; it is
+    safe because Python opens every fd non-inheritable (PEP 446). cwd is handed to
+    git as -C instead of to subprocess: together with close_fds=False and the
+    absolute GIT path, that keeps CPython on its posix_spawn fast path.
+    """
+    r = subprocess.run(
+        [cmd[0], "-C", str(cwd), *cmd[1:]],
+        env=env,
+        check=True,
+        stdout=subprocess.PIPE if capture or raw else subprocess.DEVNULL,
+        stderr=subprocess.PIPE,
+        close_fds=False,
+    )
+    if raw:
+        return r.stdout
+    return decoded(r.stdout).strip() if capture else None
+
+def decoded(data) -> str:
+    """Text of captured subprocess output (bytes or None)."""
+    return data.decode("utf-8", errors="replace") if data else ""
 
 def ensure_branch(repo: Path, branch: str):
     try:
-        sh(["git", "rev-parse", "--verify", branch], cwd=repo)
-        sh(["git", "checkout", branch], cwd=repo)
+        sh([GIT, "rev-parse", "--verify", branch], cwd=repo)
+        sh([GIT, "checkout", branch], cwd=repo)
+    except subprocess.CalledProcessError:
+        sh([GIT, "checkout", "-b", branch], cwd=repo)
+
+def is_ssh_url(url: str) -> bool:
+    """Whether git would reach url over SSH (ssh:// or scp-like user@host:path)."""
+    scheme, sep, _ = url.partition("://")
+    if sep:
+        return scheme in ("ssh", "git+ssh", "ssh+git")
+    host, colon, _ = url.partition(":")
+    return bool(colon) and "/" not in host
+
+def push_env(repo: Path, remote: str):
+    """Environment for `git push` that reuses one SSH connection across pushes.
+
+    Returns None (inherit as-is) for remotes that aren't reached over SSH, where
+    multiplexing is unavailable, or when the user already chose an SSH command.
+    """
+    if os.name != "posix" or "GIT_SSH_COMMAND" in os.environ or "GIT_SSH" in os.environ:
+        return None
+    try:
+        sh([GIT, "config", "--get", "core.sshCommand"], cwd=repo)
+        return None
+    except subprocess.CalledProcessError:
+        pass  # not configured
+    try:
+        # Applies pushurl and insteadOf like the push will
+        url = sh([GIT, "remote", "get-url", "--push", remote], cwd=repo, capture=True)
     except subprocess.CalledProcessError:
-        sh(["git", "checkout", "-b", branch], cwd=repo)
-
-def write_line(file_path: Path, line: str, prepend: bool):
-    file_path.parent.mkdir(parents=True, exist_ok=True)
-    if prepend:
-        # Prepend: read existing, write new line + existing
-        existing = ""
-        if file_path.exists():
-            existing = file_path.read_text(encoding="utf-8", errors="ignore")
-        with file_path.open("w", encoding="utf-8") as f:
-            f.write(line + ("\n" if not line.endswith("\n") else ""))
-            f.write(existing)
-    else:
-        with file_path.open("a", encoding="utf-8") as f:
-            f.write(line + ("\n" if not line.endswith("\n") else ""))
+        url = remote  # not a configured remote name, so git pushes to it as a URL
+    if not is_ssh_url(url):
+        return None
+    try:
+        control_dir = Path.home() / ".ssh"
+        control_dir.mkdir(mode=0o700, exist_ok=True)
+    except (OSError, RuntimeError) as e:  # RuntimeError: no home directory to be found
+        print(f"NOTE: not sharing SSH connections ({e}).", file=sys.stderr)
+        return None
+    control_path = shlex.quote(str(control_dir / "cm-%C"))
+    ssh = f"ssh -o ControlMaster=auto -o ControlPath={control_path} -o ControlPersist={SSH_CONTROL_PERSIST}"
+    return {**os.environ, "GIT_SSH_COMMAND": ssh}
+
+def parse_author(author: str):
+    """Split 'Name <email>' into (name, email)."""
+    m = re.fullmatch(r"\s*(.*?)\s*<([^<>]*)>\s*", author)
+    if not m:
+        raise ValueError(f"author must look like 'Name <email>', got {author!r}")
+    return m.group(1), m.group(2)
+
+class CliCommitter:
+    """Commits with the git CLI: one `git commit --only <path>` per commit.
+
+    --only stages the path and commits it in a single process, so no separate
+    `git add` is needed, and changes staged elsewhere are left in the index.
+    """
+
+    def __init__(self, repo: Path, rel: str, author=None):
+        self.repo = repo
+        self.rel = rel
+        self._tracked = False
+        # argv pieces around the message are fixed for the whole run
+        self._add_cmd = [GIT, "add", "--", rel]
+        self._commit_suffix = (["--author", author] if author else []) + ["--", rel]
+
+    def commit(self, message: str) -> bool:
+        """Commit the current contents of the path; False if there was nothing to commit."""
+        if not self._tracked:
+            # --only refuses paths git doesn't know yet, so add a new file once
+            sh(self._add_cmd, cwd=self.repo)
+            self._tracked = True
+
+        commit_cmd = [GIT, "commit", "--only", "-m", message, *self._commit_suffix]
+        try:
+            # git reports "nothing to commit" on stdout, so keep it for this one
+            sh(commit_cmd, cwd=self.repo, capture=True)
+        except subprocess.CalledProcessError as e:
+            out, err = decoded(e.stdout), decoded(e.stderr)
+            # Wording depends on what else is dirty in the worktree
+            text = (out + err).lower()
+            if any(m in text for m in ("nothing to commit", "nothing added to commit", "no changes added to commit")):
+                return False
+            raise CommitError(out, err) from e
+        return True
+
+    def flush(self):
+        pass
+
+    def close(self):
+        pass
+
+class Pygit2Committer:
+    """Stages and commits in-process through libgit2.
+
+    The repository, index and identity are loaded once, so an iteration costs no
+    fork/exec and no re-parsing of git's stdout/stderr. Like `git commit --only`,
+    the commit is the parent's tree with just the path replaced, so changes staged
+    elsewhere are left in the index and out of the commit.
+    """
+
+    def __init__(self, repo: Path, branch: str, rel: str, author=None):
+        self.repo = pygit2.Repository(str(repo))
+        self.ref = f"refs/heads/{branch}"
+        self.rel = Path(rel).as_posix()
+        config = self.repo.config
+        try:
+            self.committer = (config["user.name"], config["user.email"])
+        except KeyError:
+            raise CommitError("user.name and user.email must be set in git config for --backend pygit2")
+        self.author = parse_author(author) if author else self.committer
+
+    def commit(self, message: str) -> bool:
+        """Commit the current contents of the path; False if there was nothing to commit."""
+        try:
+            index = self.repo.index
+            index.read(force=False)  # only re-parses if the on-disk index changed behind our back
+            index.add(self.rel)
+            index.write()
+
+            ref = self.repo.references.get(self.ref)
+            parents = [ref.target] if ref is not None else []
+            base = self.repo[parents[0]].tree if parents else None
+            tree = self._replace(base, self.rel.split("/"), index[self.rel])
+            if base is not None and base.id == tree:
+                return False
+
+            self.repo.create_commit(
+                self.ref,
+                pygit2.Signature(*self.author),
+                pygit2.Signature(*self.committer),
+                message,
+                tree,
+                parents,
+            )
+        except pygit2.GitError as e:
+            raise CommitError(str(e)) from e
+        return True
+
+    def _replace(self, tree, parts, entry):
+        """Write a copy of tree (None for empty) with the path parts set to index entry entry."""
+        builder = self.repo.TreeBuilder(tree) if tree is not None else self.repo.TreeBuilder()
+        name = parts[0]
+        if len(parts) == 1:
+            builder.insert(name, entry.id, entry.mode)
+        else:
+            sub = tree[name] if tree is not None and name in tree else None
+            sub = self.repo[sub.id] if sub is not None and sub.filemode == pygit2.GIT_FILEMODE_TREE else None
+            builder.insert(name, self._replace(sub, parts[1:], entry), pygit2.GIT_FILEMODE_TREE)
+        return builder.write()
+
+    def flush(self):
+        pass
+
+    def close(self):
+        pass
+
+class FastImportCommitter:
+    """Commits through one long-lived `git fast-import` process fed over stdin.
+
+    A commit is a short record plus the file's contents written to the pipe, so no
+    process is started per commit. (`git update-index --stdin` can't fill this role:
+    it only writes the index at EOF.) fast-import moves the branch only on a
+    checkpoint, so flush() is called before every push; close() also points the
+    file's index entry back at the new HEAD. A checkpoint is not free: the pack it
+    writes is small enough (below fastimport.unpackLimit) that fast-import runs
+    `git unpack-objects` on it, one spawn per flush, so --push-every N is what
+    amortises it. Commits are made on top of the branch tip, read through a resident
+    `git cat-file --batch-check`; if something else moves the branch meanwhile,
+    flush() notices and commits the file again, once, on top of the new tip.
+    """
+
+    def __init__(self, repo: Path, branch: str, rel: str, author=None):
+        self.repo = repo
+        self.rel = rel
+        self.path = repo / rel
+        self._ref = f"refs/heads/{branch}".encode()
+        quoted = Path(rel).as_posix().replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+        self._filespec = f'M 100644 inline "{quoted}"\n'.encode()
+        try:
+            committer = sh([GIT, "var", "GIT_COMMITTER_IDENT"], cwd=repo, capture=True)
+            if author:
+                author = "%s <%s>" % parse_author(author)
+            else:
+                author = sh([GIT, "var", "GIT_AUTHOR_IDENT"], cwd=repo, capture=True).rsplit(" ", 2)[0]
+        except subprocess.CalledProcessError as e:
+            raise CommitError(decoded(e.stderr).strip()) from e
+        # Idents without the trailing "<epoch> <tz>"; --date-format=now supplies the time
+        self._idents = b"author %s now\ncommitter %s now\n" % (
+            author.encode("utf-8"), committer.rsplit(" ", 2)[0].encode("utf-8"))
+        # Run both helpers outside our process group so Ctrl-C doesn't kill them before close()
+        if os.name == "nt":
+            detach = {"creationflags": subprocess.CREATE_NEW_PROCESS_GROUP}
+        else:
+            detach = {"start_new_session": True}
+        # Resolves the branch without a rev-parse per flush
+        self._refs = subprocess.Popen(
+            [GIT, "cat-file", "--batch-check=%(objectname)"],
+            cwd=repo,
+            stdin=subprocess.PIPE,
+            stdout=subprocess.PIPE,
+            close_fds=False,
+            **detach,
+        )
+        parent = self._branch_tip()
+        # An unborn branch gets a root commit first
+        self._from = b"from %s\n" % parent.encode() if parent else b""
+        # Contents as of the last commit, starting from the parent's, so a write that
+        # leaves the file as committed doesn't make an empty commit
+        self._last = self._committed_blob(parent) if parent else None
+        self._mark = 0  # fast-import mark of the last commit we sent
+        self._unflushed = []  # messages of the commits sent since the last flush
+        self._proc = subprocess.Popen(
+            [GIT, "fast-import", "--quiet", "--date-format=now"],
+            cwd=repo,
+            stdin=subprocess.PIPE,
+            stdout=subprocess.PIPE,
+            close_fds=False,
+            **detach,
+        )
+
+    def commit(self, message: str) -> bool:
+        """Commit the current contents of the path; False if there was nothing to commit."""
+        data = self.path.read_bytes()
+        if data == self._last:
+            return False
+        self._send_commit(message, data)
+        return True
+
+    def flush(self):
+        """Update the branch ref to the last commit sent (a fast-import checkpoint)."""
+        if not self._unflushed:
+            return
+        if self._checkpoint() != self._branch_tip():
+            # Something else moved the branch (a commit, a pull) and fast-import won't
+            # rewind it, so our commits since the last flush are off the branch. Their
+            # lines are still in the file: commit it again on top of the new tip.
+            print(f"NOTE: {self._ref.decode()} moved during the run; re-committing "
+                  f"{len(self._unflushed)} commit(s) on top of it as one.", file=sys.stderr)
+            message = squash_message(self._unflushed)
+            self._unflushed = []
+            self._from = b"from %s^0\n" % self._ref
+            self._send_commit(message, self.path.read_bytes())
+            if self._checkpoint() != self._branch_tip():
+                raise CommitError(f"git fast-import could not update {self._ref.decode()}")
+        self._unflushed = []
+
+    def _send_commit(self, message: str, data: bytes):
+        self._mark += 1
+        msg = message.encode("utf-8")
+        self._send(
+            b"commit %s\n" % self._ref,
+            b"mark :%d\n" % self._mark,
+            self._idents,
+            b"data %d\n" % len(msg), msg, b"\n",
+            self._from,
+            self._filespec,
+            b"data %d\n" % len(data), data, b"\n",
+        )
+        self._from = b""  # later commits continue from the branch tip fast-import tracks
+        self._last = data
+        self._unflushed.append(message)
+
+    def _checkpoint(self) -> str:
+        """Write out refs and return the object id of the last commit sent."""
+        self._send(b"checkpoint\nget-mark :%d\n" % self._mark)
+        # get-mark is answered once everything before it, the checkpoint included, is done
+        line = self._proc.stdout.readline()
+        if not line:
+            raise CommitError(f"git fast-import exited with status {self._proc.wait()}")
+        return line.strip().decode()
+
+    def _branch_tip(self):
+        """Object id the branch points at, or None while it is unborn."""
+        try:
+            self._refs.stdin.write(self._ref + b"\n")
+            self._refs.stdin.flush()
+        except OSError as e:
+            raise CommitError(f"git cat-file exited with status {self._refs.wait()}") from e
+        line = self._refs.stdout.readline()
+        if not line:
+            raise CommitError(f"git cat-file exited with status {self._refs.wait()}")
+        line = line.strip()
+        return None if line.endswith(b" missing") else line.decode()
+
+    def close(self):
+        try:
+            self.flush()
+        finally:
+            try:
+                self._proc.stdin.close()  # at EOF fast-import also updates the refs
+            except OSError:
+                pass
+            self._proc.wait()
+            self._refs.stdin.close()
+            self._refs.wait()
+        if self._mark:
+            # The commits bypassed the index; point the file's entry at the new HEAD
+            sh([GIT, "reset", "-q", "--", self.rel], cwd=self.repo)
+
+    def _committed_blob(self, commit: str):
+        """Contents of the file in commit, or None if it isn't there."""
+        try:
+            return sh([GIT, "cat-file", "blob", f"{commit}:{Path(self.rel).as_posix()}"], cwd=self.repo, raw=True)
+        except subprocess.CalledProcessError:
+            return None
+
+    def _send(self, *chunks):
+        try:
+            self._proc.stdin.write(b"".join(chunks))
+            self._proc.stdin.flush()
+        except OSError as e:
+            raise CommitError(f"git fast-import exited with status {self._proc.wait()}") from e
+
+_ts_cache = (None, "")  # (epoch second, formatted prefix); one tuple so threads see a consistent pair
+
+def utc_timestamp() -> str:
+    """Current UTC time as YYYY-MM-DDTHH:MM:SS.ffffffZ.
+
+    Same output as datetime.now(timezone.utc).strftime(...), without allocating a
+    datetime; the seconds part is formatted once per second and reused.
+    """
+    global _ts_cache
+    sec, ns = divmod(time.time_ns(), 1_000_000_000)
+    cached_sec, prefix = _ts_cache
+    if sec != cached_sec:
+        prefix = "%04d-%02d-%02dT%02d:%02d:%02d" % time.gmtime(sec)[:6]
+        _ts_cache = (sec, prefix)
+    return "%s.%06dZ" % (prefix, ns // 1000)
+
+def make_committer(backend: str, repo: Path, branch: str, rel: str, author=None):
+    if backend == "pygit2":
+        if not load_pygit2():
+            raise ValueError("backend pygit2 requires the pygit2 package (pip install pygit2)")
+        return Pygit2Committer(repo, branch, rel, author)
+    if backend == "fast-import":
+        return FastImportCommitter(repo, branch, rel, author)
+    if backend == "cli":
+        return CliCommitter(repo, rel, author)
+    raise ValueError(f"unknown backend {backend!r}")
+
+def batch_size(value: str) -> int:
+    """argparse type: an int between 1 and MAX_BATCH."""
+    import argparse
+
+    n = int(value)
+    if not 1 <= n <= MAX_BATCH:
+        raise argparse.ArgumentTypeError(f"must be between 1 and {MAX_BATCH}, got {n}")
+    return n
+
+def write_all(fd: int, data):
+    view = memoryview(data)
+    while view:
+        view = view[os.write(fd, view):]
+    view.release()
+
+def file_stamp(path):
+    """(device, inode, size, mtime) of path (or an open fd), or None if it doesn't exist."""
+    try:
+        st = os.stat(path)
+    except FileNotFoundError:
+        return None
+    return (st.st_dev, st.st_ino, st.st_size, st.st_mtime_ns)
+
+class AppendWriter:
+    """Appends each batch of lines to the bottom of the file.
+
+    The file is opened with O_APPEND and the fd is reused, so a batch of encoded,
+    newline-terminated lines is a single os.write. Writes still land at the current
+    end even if something else appends to the file in between. If the file is
+    deleted or replaced (a checkout, a stash, an editor saving by rename), it is
+    reopened instead of writing on to the orphaned inode.
+    """
+
+    def __init__(self, file_path: Path):
+        self.path = file_path
+        self._fd = None
+        self._stamp = None  # file_stamp() of the file as we last left it
+
+    def write(self, lines):
+        if self._fd is None or file_stamp(self.path) != self._stamp:
+            self.close()
+            flags = os.O_WRONLY | os.O_APPEND | os.O_CREAT | getattr(os, "O_BINARY", 0)
+            self._fd = os.open(self.path, flags, 0o644)
+        write_all(self._fd, b"".join(lines))
+        self._stamp = file_stamp(self._fd)
+
+    def close(self):
+        if self._fd is not None:
+            os.close(self._fd)
+            self._fd = None
+
+class PrependWriter:
+    """Inserts each batch of lines at the top of the file, newest line first.
+
+    The file is read once and its bytes are kept in memory, so a batch costs one
+    write of new lines + cached contents instead of a read, decode, encode and
+    rewrite. The file only grows, so it never needs truncating. If something else
+    replaces or edits the file, the cache is reloaded from disk.
+    """
+
+    def __init__(self, file_path: Path):
+        self.path = file_path
+        self._fd = None
+        self._buf = bytearray()
+        self._stamp = None  # file_stamp() of the file as we last left it
+
+    def write(self, lines):
+        if self._fd is None or file_stamp(self.path) != self._stamp:
+            self._reload()
+
+        self._buf[0:0] = b"".join(reversed(lines))
+        os.lseek(self._fd, 0, os.SEEK_SET)
+        write_all(self._fd, self._buf)
+        self._stamp = file_stamp(self._fd)
+
+    def close(self):
+        if self._fd is not None:
+            os.close(self._fd)
+            self._fd = None
+
+    def _reload(self):
+        self.close()
+        self._fd = os.open(self.path, os.O_RDWR | os.O_CREAT | getattr(os, "O_BINARY", 0), 0o644)
+        self._buf = bytearray()
+        while chunk := os.read(self._fd, 1 << 20):
+            self._buf += chunk
+
+def line_builder(template: str):
+    """Return a function turning a timestamp into the encoded, newline-terminated line.
+
+    A template whose only field is a bare {ts} (the usual case) is split once into
+    prefix/suffix bytes, so building a line is one concatenation instead of a
+    str.format call. A line gets a newline unless the template already ends in one.
+    """
+    eol = "" if template.endswith("\n") else "\n"
+    head, sep, tail = template.partition("{ts}")
+    if sep and not any(c in head + tail for c in "{}"):
+        prefix, suffix = head.encode("utf-8"), (tail + eol).encode("utf-8")
+        return lambda ts: prefix + ts.encode("ascii") + suffix
+    return lambda ts: (template.format(ts=ts) + eol).encode("utf-8")
+
+def batch_message(prefix: str, stamps) -> str:
+    if len(stamps) == 1:
+        return f"{prefix} {stamps[0]}"
+    return f"{prefix} {stamps[0]} .. {stamps[-1]} ({len(stamps)} heartbeats)"
+
+def squash_message(messages) -> str:
+    """One message standing for several commits folded into one."""
+    if len(messages) == 1:
+        return messages[0]
+    return f"{messages[0]} .. {messages[-1]} ({len(messages)} commits)"
+
+def try_commit(committer, message: str) -> bool:
+    """Commit, reporting failures instead of raising; True if a commit was made."""
+    try:
+        return committer.commit(message)
+    except CommitError as e:
+        print("Commit failed:\n", *e.args, file=sys.stderr)
+        return False
+
+def commit_batch(committer, writer, lines, stamps, prefix: str) -> bool:
+    """Write the buffered lines, commit them once and clear the buffers; True if a commit was made."""
+    writer.write(lines)
+    message = batch_message(prefix, stamps)
+    lines.clear()
+    stamps.clear()
+    return try_commit(committer, message)
+
+def flush_commits(committer) -> bool:
+    """Make created commits visible on the branch before a push; True on success."""
+    try:
+        committer.flush()
+    except CommitError as e:
+        print("Commit failed:\n", *e.args, file=sys.stderr)
+        return False
+    return True
+
+def schedule(interval: float, stop_at=None, stop=None):
+    """Yield once per tick, every interval seconds on a monotonic schedule.
+
+    Time spent by the caller between ticks doesn't stretch the period. When a tick
+    overruns, the next one follows immediately and missed ticks are dropped. Stops
+    instead of yielding a tick that would fall at or after stop_at, or as soon as
+    the threading.Event stop is set.
+    """
+    deadline = time.monotonic()
+    while stop is None or not stop.is_set():
+        yield True
+        deadline += interval
+        now = time.monotonic()
+        if stop_at is not None and max(deadline, now) >= stop_at:
+            return
+        if deadline <= now:
+            deadline = now
+        elif stop is not None:
+            stop.wait(deadline - now)
+        else:
+            time.sleep(deadline - now)
+
+# inotify_event: int wd; uint32_t mask, cookie, len; char name[len]
+_INOTIFY_EVENT = "iIII"
+IN_MODIFY = 0x002
+IN_CLOSE_WRITE = 0x008
+IN_MOVED_TO = 0x080
+
+def inotify_watch(directory: Path):
+    """inotify fd watching directory for writes and renames into it, or None.
+
+    Writes are seen as they happen (IN_MODIFY), not only on close, so a writer that
+    keeps the file open still triggers commits. None when inotify isn't available
+    (not Linux, or the calls fail).
+    """
+    if not sys.platform.startswith("linux"):
+        return None
+    import ctypes
+    try:
+        libc = ctypes.CDLL(None, use_errno=True)
+        fd = libc.inotify_init1(os.O_CLOEXEC | os.O_NONBLOCK)
+    except (OSError, AttributeError):
+        return None
+    if fd < 0:
+        return None
+    if libc.inotify_add_watch(fd, os.fsencode(directory), IN_MODIFY | IN_CLOSE_WRITE | IN_MOVED_TO) < 0:
+        os.close(fd)
+        return None
+    return fd
+
+def inotify_names(fd: int):
+    """Names from all pending events on an inotify fd."""
+    import struct
+    header = struct.calcsize(_INOTIFY_EVENT)
+    names = set()
+    try:
+        data = os.read(fd, 64 * 1024)
+    except BlockingIOError:
+        return names
+    offset = 0
+    while offset < len(data):
+        _, _, _, length = struct.unpack_from(_INOTIFY_EVENT, data, offset)
+        offset += header
+        names.add(data[offset:offset + length].rstrip(b"\0"))
+        offset += length
+    return names
+
+def watch_changes(path: Path, interval: float, stop_at=None, stop=None):
+    """Yield True after path was written or replaced, or False after interval quiet seconds.
+
+    Uses inotify on the parent directory (so editors that save by renaming a temp
+    file over path are seen as well) and sleeps in select(); where inotify is not
+    available it falls back to comparing path's stat every interval. Stops once
+    stop_at (a monotonic time) has passed, or within interval seconds of the
+    threading.Event stop being set.
+    """
+    import select
+    name = os.fsencode(path.name)
+    fd = inotify_watch(path.parent)
+    stamp = file_stamp(path) if fd is None else None
+    try:
+        while stop is None or not stop.is_set():
+            timeout = interval
+            if stop_at is not None:
+                timeout = min(timeout, stop_at - time.monotonic())
+                if timeout <= 0:
+                    return
+            if fd is not None:
+                ready, _, _ = select.select([fd], [], [], timeout)
+                # One read drains every queued event, so a burst becomes one commit
+                yield bool(ready) and name in inotify_names(fd)
+            else:
+                if stop is not None:
+                    stop.wait(timeout)
+                else:
+                    time.sleep(timeout)
+                new_stamp = file_stamp(path)
+                changed, stamp = new_stamp != stamp, new_stamp
+                yield changed
+    finally:
+        if fd is not None:
+            os.close(fd)
+
+class BackgroundPusher:
+    """Runs `git push` on a worker thread so the loop never waits on the network.
+
+    At most one push is in flight. Requests made meanwhile are coalesced into a
+    single follow-up push, since one push carries every commit made so far. After a
+    failure the retry waits PUSH_RETRY_BASE seconds, doubling per consecutive
+    failure up to PUSH_RETRY_CAP, so an outage or rate limit isn't hammered.
+    """
+
+    def __init__(self, repo: Path, remote: str, branch: str, env=None):
+        self.repo = repo
+        self.remote = remote
+        self.branch = branch
+        self.env = env
+        self._cmd = [GIT, "push", remote, branch]
+        from concurrent.futures import ThreadPoolExecutor
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="git-push")
+        self._future = None
+        self._wanted = False
+        self._failures = 0  # consecutive failed pushes
+        self._retry_at = 0.0  # monotonic time before which no retry starts
+
+    def request(self):
+        """Queue a push of everything committed so far."""
+        self._wanted = True
+        self.poll()
+
+    def poll(self):
+        """Reap a finished push and start a queued one; call once per loop."""
+        if self._future is not None:
+            if not self._future.done():
+                return
+            self._future.result()  # surface unexpected errors on the main thread
+            self._future = None
+        if self._wanted and time.monotonic() >= self._retry_at:
+            self._wanted = False
+            self._future = self._executor.submit(self._push)
+
+    def close(self):
+        """Wait for the in-flight push, then push once more (ignoring any backoff) if anything is still queued."""
+        if self._future is not None:
+            self._future.result()
+            self._future = None
+        if self._wanted:
+            self._wanted = False
+            self._push(final=True)
+        self._executor.shutdown(wait=True)
+
+    def _push(self, final=False):
+        try:
+            sh(self._cmd, cwd=self.repo, env=self.env)
+        except subprocess.CalledProcessError as e:
+            if final:  # the last push from close(); nothing will retry it
+                print("Push failed:\n", decoded(e.stderr), file=sys.stderr)
+                return
+            delay = min(PUSH_RETRY_CAP, PUSH_RETRY_BASE * 2 ** self._failures)
+            self._failures += 1
+            self._retry_at = time.monotonic() + delay
+            print(f"Push failed (will retry in {delay:g}s):\n", decoded(e.stderr), file=sys.stderr)
+            self._wanted = True
+        else:
+            self._failures = 0
+            self._retry_at = 0.0
+
+def run_loop(
+    *,
+    repo,
+    branch: str,
+    remote: str = "origin",
+    file: str = "README.md",
+    interval: float = 1.0,
+    message: str = "[bot] heartbeat",
+    author=None,
+    line_template: str = "- heartbeat {ts}",
+    prepend: bool = False,
+    push: bool = True,
+    ssh_multiplex: bool = True,
+    backend: str = "cli",
+    batch_commits: int = 1,
+    push_every: int = 1,
+    max_commits: int = 0,
+    max_runtime_seconds: float = 0.0,
+    on_change: bool = False,
+    stop=None,
+) -> int:
+    """Run the commit loop until a limit is hit or Ctrl-C; return the number of commits made.
+
+    The library entry point behind main(): the keywords mirror the command-line
+    options (push and ssh_multiplex are the inverse of --no-push and
+    --no-ssh-multiplex), so a supervisor can drive one or more loops, e.g. in
+    threads, from a single interpreter. stop, a threading.Event, ends the loop
+    from another thread the way Ctrl-C does: pending lines are committed and
+    pushed. The backend, writer and pusher are shut down however the loop exits.
+    Raises ValueError for bad arguments, CommitError if the backend can't start,
+    and CalledProcessError if git fails during setup.
+    """
+    if not (1 <= batch_commits <= MAX_BATCH and 1 <= push_every <= MAX_BATCH):
+        raise ValueError(f"batch_commits and push_every must be between 1 and {MAX_BATCH}")
+    if max_commits < 0 or max_runtime_seconds < 0:
+        raise ValueError("max_commits and max_runtime_seconds must not be negative")
+
+    repo = Path(repo).expanduser().resolve()
+    if not (repo / ".git").exists():
+        raise ValueError(f"{repo} does not look like a git repository (.git missing)")
+
+    # Every backend commits only the file, so only its own changes end up in a commit.
+    # Untracked files don't matter and listing them (or scanning submodule worktrees)
+    # is the slow part on big repos.
+    status = sh([GIT, "status", "--porcelain", "--untracked-files=no", "--ignore-submodules=dirty", "--", file],
+                cwd=repo, capture=True)
+    if status:
+        print(f"NOTE: {file} has uncommitted changes; they will be included in the first commit.",
+              file=sys.stderr)
+
+    ensure_branch(repo, branch)
+    target_path = repo / file
+    rel = str(target_path.relative_to(repo))
+    with contextlib.ExitStack() as cleanup:
+        committer = make_committer(backend, repo, branch, rel, author)
+        # Shut everything down on any exit, not just Ctrl-C; callbacks run in reverse
+        cleanup.callback(committer.close)
+
+        if on_change:
+            print(f"Starting: repo={repo}, branch={branch}, committing changes to {file}, "
+                  f"backend={backend}, push every {push_every}")
+        else:
+            print(f"Starting: repo={repo}, branch={branch}, file={file}, every {interval}s, "
+                  f"backend={backend}, batch={batch_commits}, push every {push_every}")
+
+        # The writers (and the watch) expect the directory to exist; create it once here
+        target_path.parent.mkdir(parents=True, exist_ok=True)
+        writer = None
+        if not on_change:
+            writer = PrependWriter(target_path) if prepend else AppendWriter(target_path)
+            cleanup.callback(writer.close)
+        pusher = None
+        if push:
+            pusher = BackgroundPusher(repo, remote, branch, push_env(repo, remote) if ssh_multiplex else None)
+            cleanup.callback(pusher.close)
+        build_line = line_builder(line_template)
+        lines, stamps = [], []  # encoded lines not yet committed, and their timestamps
+        pending_commits = 0  # commits not yet handed to the pusher
+        total_commits = 0
+        stop_at = time.monotonic() + max_runtime_seconds if max_runtime_seconds else None
+        if on_change:
+            ticks = watch_changes(target_path, interval, stop_at, stop)
+        else:
+            ticks = schedule(interval, stop_at, stop)
+        cleanup.callback(ticks.close)  # releases the inotify fd
+        try:
+            for changed in ticks:
+                if on_change:
+                    committed = changed and try_commit(committer, f"{message} {utc_timestamp()}")
+                else:
+                    ts = utc_timestamp()
+                    lines.append(build_line(ts))
+                    stamps.append(ts)
+                    committed = len(lines) >= batch_commits and commit_batch(committer, writer, lines, stamps, message)
+                if committed:
+                    pending_commits += 1
+                    total_commits += 1
+
+                if pusher is not None:
+                    if pending_commits >= push_every and flush_commits(committer):
+                        pusher.request()
+                        pending_commits = 0
+                    else:
+                        pusher.poll()
+
+                if max_commits and total_commits >= max_commits:
+                    print(f"Stopping: made {total_commits} commits (commit limit).")
+                    break
+            else:
+                if stop is not None and stop.is_set():
+                    print("Stopping: stop requested.")
+                else:
+                    print(f"Stopping: ran for {max_runtime_seconds:g}s (runtime limit).")
+        except KeyboardInterrupt:
+            print("\nStopped by user.")
+
+        # Flush whatever is still buffered so no heartbeat is lost on shutdown
+        if lines and commit_batch(committer, writer, lines, stamps, message):
+            total_commits += 1
+        flush_commits(committer)
+        if pusher is not None:
+            # Push even if nothing looks pending: Ctrl-C can land after git created
+            # a commit but before it was counted
+            pusher.request()
+    return total_commits
 
 def main():
+    import argparse
     ap = argparse.ArgumentParser(description="Loop commits that update a target file (e.g., README.md).")
     ap.add_argument("--repo", required=True, help="Path to local git repository")
     ap.add_argument("--branch", required=True, help="Branch to commit to / push")
@@ -62,60 +909,51 @@ def main():
     ap.add_argument("--line-template", default="- heartbeat {ts}", help="Text to insert; supports {ts} placeholder")
     ap.add_argument("--prepend", action="store_true", help="Insert at the top of the file (default: append to bottom)")
     ap.add_argument("--no-push", action="store_true", help="Do not push to remote (local commits only)")
+    ap.add_argument("--no-ssh-multiplex", action="store_true",
+                    help="Open a new SSH connection for every push instead of sharing one")
+    ap.add_argument("--backend", choices=("cli", "pygit2", "fast-import"), default="cli",
+                    help="How commits are created: git CLI subprocesses, in-process pygit2, or one "
+                         "long-running git fast-import (default: cli)")
+    ap.add_argument("--batch-commits", type=batch_size, default=1, metavar="N",
+                    help=f"Lines to accumulate per commit, 1-{MAX_BATCH} (default: 1)")
+    ap.add_argument("--push-every", type=batch_size, default=1, metavar="M",
+                    help=f"Commits to accumulate per push, 1-{MAX_BATCH} (default: 1)")
+    ap.add_argument("--max-commits", type=int, default=0, metavar="N",
+                    help="Stop after N commits (default: 0, no limit)")
+    ap.add_argument("--max-runtime-seconds", type=float, default=0.0, metavar="S",
+                    help="Stop after about S seconds (default: 0, no limit)")
+    ap.add_argument("--on-change", action="store_true",
+                    help="Don't write lines; commit whenever --file is changed by something else")
     args = ap.parse_args()
+    if args.max_commits < 0 or args.max_runtime_seconds < 0:
+        ap.error("--max-commits and --max-runtime-seconds must not be negative")
 
-    repo = Path(args.repo).expanduser().resolve()
-    if not (repo / ".git").exists():
-        print(f"ERROR: {repo} does not look like a git repository (.git missing)", file=sys.stderr)
-        sys.exit(2)
-
-    # Warn if working tree has changes
     try:
-        status = sh(["git", "status", "--porcelain"], cwd=repo)
-        if status:
-            print("NOTE: Working tree has changes; they may be included in commits.", file=sys.stderr)
+        run_loop(
+            repo=args.repo,
+            branch=args.branch,
+            remote=args.remote,
+            file=args.file,
+            interval=args.interval,
+            message=args.message,
+            author=args.author,
+            line_template=args.line_template,
+            prepend=args.prepend,
+            push=not args.no_push,
+            ssh_multiplex=not args.no_ssh_multiplex,
+            backend=args.backend,
+            batch_commits=args.batch_commits,
+            push_every=args.push_every,
+            max_commits=args.max_commits,
+            max_runtime_seconds=args.max_runtime_seconds,
+            on_change=args.on_change,
+        )
+    except (ValueError, CommitError) as e:
+        print(f"ERROR: {e}", file=sys.stderr)
+        sys.exit(2)
     except subprocess.CalledProcessError as e:
-        print(e.stderr, file=sys.stderr)
+        print(decoded(e.stderr), file=sys.stderr)
         sys.exit(3)
 
-    ensure_branch(repo, args.branch)
-    target_path = repo / args.file
-    print(f"Starting: repo={repo}, branch={args.branch}, file={args.file}, every {args.interval}s")
-
-    try:
-        while True:
-            ts = datetime.now(timezone.utc).strftime("%Y-%m-%dT%H:%M:%S.%fZ")
-            line = args.line-template if hasattr(args, "line-template") else args.line_template  # guard for hyphen
-            # Python can't use args.line-template; the parser stored it as line_template
-            line = args.line_template.format(ts=ts)
-            write_line(target_path, line, args.prepend)
-
-            rel = str(target_path.relative_to(repo))
-            sh(["git", "add", rel], cwd=repo)
-
-            commit_cmd = ["git", "commit", "-m", f"{args.message} {ts}"]
-            if args.author:
-                commit_cmd += ["--author", args.author]
-
-            try:
-                sh(commit_cmd, cwd=repo)
-            except subprocess.CalledProcessError as e:
-                if "nothing to commit" in (e.stdout + e.stderr).lower():
-                    pass
-                else:
-                    print("Commit failed:\n", e.stdout, e.stderr, file=sys.stderr)
-                    time.sleep(args.interval)
-                    continue
-
-            if not args.no_push:
-                try:
-                    sh(["git", "push", args.remote, args.branch], cwd=repo)
-                except subprocess.CalledProcessError as e:
-                    print("Push failed (will retry on next loop):\n", e.stdout, e.stderr, file=sys.stderr)
-
-            time.sleep(args.interval)
-    except KeyboardInterrupt:
-        print("\nStopped by user.")
-
 if __name__ == "__main__":
     main()